@@ -1,11 +1,12 @@
 import requests
+from requests.adapters import HTTPAdapter
+import orjson
 import polars
-import matplotlib.pyplot as plt
 import sqlite3
-import pickle
+import threading
+import io
 import datetime
 from pathlib import Path
-from hashlib import blake2b
 from typing import Literal
 
 
@@ -20,10 +21,16 @@ class API:
     class Cache:
         """
         Helper class for caching data returned by calls to the US Treasury Fiscal Data API.
-        Implements 3 functions:
+        Implements 9 functions:
         initialize: Creates the caching database file and table.
         insert: Stores new data into the caching database.
-        pull: Retrieves data from the caching database.
+        insert_many: Stores new data for several terms into the caching database in a single transaction.
+        pull: Retrieves data from the caching database, or from memory if it was already retrieved by this process.
+        pull_many: Retrieves data for several terms from the caching database with a single query.
+        pull_validators: Retrieves the HTTP cache validators of the most recently cached data for a term.
+        pull_validators_many: Retrieves the HTTP cache validators shared by data cached together for several terms.
+        renew: Extends the expiry of previously cached data which the API reports is unchanged.
+        renew_many: Extends the expiry of previously cached data for several terms in a single transaction.
         """
 
         # The SQLite3 database cache file is stored at this path.
@@ -32,17 +39,36 @@ class API:
         # All ISO8601 timestamps are generated using the UTC+0 timezone.
         timezone = datetime.timezone.utc
 
+        # In-process copy of the most recently cached DataFrame for each term, alongside its expiry timestamp. Repeat
+        # pulls within the same process are served from here without touching the cache database.
+        _mem_cache: dict[str, tuple[datetime.datetime, polars.DataFrame]] = {}
+
+        # A single long-lived connection to the cache database is opened by initialize() and shared by every insert and
+        # pull. If initialize() wasn't called first, the first insert or pull calls it. It is in autocommit mode. This
+        # script itself is single-threaded, but the connection allows use from any thread (check_same_thread=False) and
+        # access is serialized by a lock, so that library callers who call into the API class from several threads at
+        # once can do so safely.
+        _con: sqlite3.Connection | None = None
+        _lock = threading.Lock()
+        _init_lock = threading.Lock()
+
         @staticmethod
         def initialize() -> None:
             """Creates a sqlite3 database file named cache.sqlite3 in .../fiscaldata/ if it does not already exist.
             Then, creates a table named 'cache' where data sourced from the US Treasury Fiscal Data API is stored. These
             operations are individually no-op if the database file already exists or the cache table already exists.
+            Finally, opens the connection to the database file which is used by every later insert and pull. Calling
+            this function again once that connection is open is a no-op.
 
             Specifically, the cached data is sourced from the v1/accounting/od/auctions_query endpoint, which provides
             data about different types of Treasury issued securities. In the case of this script, data about Treasury
             Bills are received.
             """
 
+            # No-op if the cache database was already initialized by this process.
+            if API.Cache._con is not None:
+                return
+
             # Try to create .../fiscaldata/cache.sqlite3 or no-op if it already exists:
             try:
                 with open(API.Cache.cache_file_path, "x+b") as _:
@@ -53,7 +79,7 @@ class API:
 
             # Try to create a table named "cache" in .../fiscaldata/cache.sqlite3 or no-op if it already exists.
 
-            # The table has 6 columns:
+            # The table has 7 columns:
             # "id" is an integer primary key not null alias for _rowid_.
             # "term" is a not null text literal value. One of: "4-Week", "8-Week", "13-Week", "26-Week", "52-Week".
             # > These values correspond to the 5 different maturity lengths of Treasury Bills.
@@ -62,74 +88,415 @@ class API:
             # "expires" is a not null text ISO8601 timestamp. Values in this column indicate when the row should be
             # > considered "stale" and not reused. By default, this timestamp is one day after the timestamp stored
             # > in the "retrieved" column of the same row.
-            # data is a not null blob. These values are pickled polars DataFrames containing plotting-ready transformed
-            # > data from previous API calls.
-            # blake2b is a unique not null text hexadecimal blake2b hash of the pickled DataFrame stored in "data"
-            # > column of the same row.
+            # data is a not null blob. These values are polars DataFrames serialized in the zstd compressed Arrow IPC
+            # > format, which contain plotting-ready transformed data from previous API calls.
+            # "etag" is a nullable text value. Values in this column are the ETag header sent by the API alongside
+            # > the data in the same row, if there was one.
+            # "last_modified" is a nullable text value. Values in this column are the Last-Modified header sent by the
+            # > API alongside the data in the same row, if there was one.
+            # Each pair of "term" and "retrieved" values is unique.
+
+            con = sqlite3.connect(
+                API.Cache.cache_file_path, check_same_thread=False, isolation_level=None
+            )
+            # The connection is only kept once the whole schema below is in place. If any step fails, it is closed so
+            # that a later call to this function starts over rather than treating a half-migrated database as ready.
+            try:
+                # Write-ahead logging with relaxed syncing makes commits considerably cheaper. Losing the most recent
+                # cache writes in a power failure is harmless, they will just be fetched from the API again.
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+                con.execute("PRAGMA temp_store=MEMORY")
+
+                # Cache tables created by older versions of this script have a sixth column, "blake2b", holding a
+                # unique hash of the "data" column. SQLite can't drop a UNIQUE column, so the old table is dropped
+                # and recreated below instead. Its rows are just cached API responses, which will be fetched again.
+                columns = [row[1] for row in con.execute("PRAGMA table_info(cache)")]
+                if "blake2b" in columns:
+                    con.execute("DROP TABLE cache")
 
-            with sqlite3.connect(API.Cache.cache_file_path) as con:
                 con.execute(
                     "CREATE TABLE IF NOT EXISTS cache (id INTEGER NOT NULL, term TEXT NOT NULL, retrieved TEXT NOT "
-                    "NULL, expires TEXT NOT NULL, data BLOB NOT NULL, blake2b TEXT UNIQUE NOT NULL, PRIMARY KEY (id))"
+                    "NULL, expires TEXT NOT NULL, data BLOB NOT NULL, etag TEXT, last_modified TEXT, PRIMARY KEY (id), "
+                    "UNIQUE (term, retrieved))"
                 )
 
+                # Cache tables created by older versions of this script lack the "etag" and "last_modified" columns.
+                # Both are nullable, so they can simply be added to the existing table.
+                columns = [row[1] for row in con.execute("PRAGMA table_info(cache)")]
+                for column in ("etag", "last_modified"):
+                    if column not in columns:
+                        con.execute(f"ALTER TABLE cache ADD COLUMN {column} TEXT")
+
+                # Every pull looks up unexpired rows for a term, so index the table on exactly that. This lets those
+                # lookups seek directly to matching rows rather than scanning the whole table as it grows.
+                con.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_cache_term_expires ON cache (term, expires DESC)"
+                )
+            except BaseException:
+                con.close()
+                raise
+            API.Cache._con = con
+
+        @staticmethod
+        def _connection() -> sqlite3.Connection:
+            """Returns the connection to the cache database. If this process hasn't initialized the cache database yet,
+            it is initialized first, so the cache can be used without calling initialize explicitly.
+            """
+            # Only one thread at a time may initialize the cache database.
+            with API.Cache._init_lock:
+                if API.Cache._con is None:
+                    API.Cache.initialize()
+            return API.Cache._con
+
         @staticmethod
         def insert(
             term: Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"],
-            _o: object,
+            _o: polars.DataFrame,
+            etag: str | None = None,
+            last_modified: str | None = None,
         ) -> None:
             """
             Inserts data retrieved from the US Treasury Fiscal Data API into the cache database after it has been
-            received and parsed from JSON into a Python object by the caller. This function then serializes the
-            caller's data-containing object using pickle, and stored in the cache database alongside its hash,
-            the time of its retrieval (really the time of calling this function), and an expiry date (one day from
-            its time of retrieval). Data can be pulled from the cache on subsequent executions of this script on the
-            same day, rather than making redundant API calls.
+            received and transformed into a polars DataFrame by the caller. This function then serializes the
+            caller's DataFrame in the Arrow IPC format, and stores it in the cache database alongside the time of its
+            retrieval (really the time of calling this function), and an expiry date (one day from its time of
+            retrieval). Data can be pulled from the cache on subsequent executions of this script on the same day,
+            rather than making redundant API calls. The optional arguments etag and last_modified are the ETag and
+            Last-Modified headers of the API response the data came from, which are stored so later API calls can be
+            made conditional on the data having changed.
+            """
+            # Inserting a single row is just a batch of one.
+            API.Cache.insert_many([(term, _o, etag, last_modified)])
+
+        @staticmethod
+        def insert_many(
+            rows: list[
+                tuple[
+                    Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"],
+                    polars.DataFrame,
+                    str | None,
+                    str | None,
+                ]
+            ],
+        ) -> None:
+            """Inserts several rows of data into the cache database in a single transaction, so that they are committed
+            all at once rather than one at a time. Each row is a tuple of the arguments insert would otherwise be called
+            with: the term, the DataFrame, and the ETag and Last-Modified headers of the API response (or None).
             """
-            # Serialize (pickle) data from parsed JSON response
-            pickled_o = pickle.dumps(_o)
-            # Calculate blake2b digest, store as ASCII string
-            digest = blake2b(pickled_o).hexdigest()
             # Use UTC+0 as frame of reference for time of retrieval/expiry.
             # Time of retrieval is whenever this function is called, not when the data was truly retrieved.
             # Subsequent loss of accuracy shouldn't matter for this application.
             retrieved = datetime.datetime.now(tz=API.Cache.timezone)
             # Time of expiry is the time of retrieval plus one day.
             expires = retrieved + datetime.timedelta(days=1)
-            # INSERT the data into the cache. If there is a conflict caused by trying to insert data with a non-unique
-            # hash, use the conflict resolution algorithm IGNORE.
-            args = (None, term, retrieved, expires, pickled_o, digest)
-            with sqlite3.connect(API.Cache.cache_file_path) as con:
-                con.execute(
-                    "INSERT OR IGNORE INTO cache VALUES (?, ?, ?, ?, ?, ?)", args
+
+            args = []
+            for term, _o, etag, last_modified in rows:
+                # Serialize the DataFrame to zstd compressed Arrow IPC bytes. Columnar date and float data compresses
+                # well, and zstd decompresses quickly enough that reading it back costs very little.
+                buffer = io.BytesIO()
+                _o.write_ipc(buffer, compression="zstd")
+                serialized_o = buffer.getvalue()
+                args.append(
+                    (None, term, retrieved, expires, serialized_o, etag, last_modified)
                 )
 
+            # INSERT the data into the cache. If there is a conflict caused by trying to insert data for a term that was
+            # already retrieved at the same time, use the conflict resolution algorithm IGNORE. The connection is in
+            # autocommit mode, so the transaction has to be opened and committed explicitly.
+            con = API.Cache._connection()
+            with API.Cache._lock:
+                con.execute("BEGIN")
+                try:
+                    con.executemany(
+                        "INSERT OR IGNORE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)", args
+                    )
+                except BaseException:
+                    con.execute("ROLLBACK")
+                    raise
+                con.execute("COMMIT")
+
+            # Keep a copy in memory for subsequent pulls made by this process.
+            for term, _o, _, _ in rows:
+                API.Cache._mem_cache[term] = (expires, _o)
+
         @staticmethod
         def pull(
-            term: Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"]
+            term: Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"],
         ) -> polars.DataFrame | None:
             """Pulls any unexpired DataFrame for the specified bill maturity if there is any. Otherwise,
             returns None."""
+            now = datetime.datetime.now(tz=API.Cache.timezone)
 
-            # Select data from up to one row from the cache database.
-            with sqlite3.connect(API.Cache.cache_file_path) as con:
+            # Return the in-memory copy of the data if this process already has an unexpired one.
+            mem_cached = API.Cache._mem_cache.get(term)
+            if mem_cached is not None and mem_cached[0] >= now:
+                return mem_cached[1]
+
+            # Select data from up to one row from the cache database. If there are several unexpired rows, the newest one
+            # (the one expiring last) is selected.
+            con = API.Cache._connection()
+            with API.Cache._lock:
                 data = con.execute(
-                    "SELECT data FROM cache WHERE expires >= ? AND term == ? LIMIT 1",
-                    (datetime.datetime.now(tz=API.Cache.timezone), term),
+                    "SELECT expires, data FROM cache WHERE expires >= ? AND term == ? ORDER BY expires DESC LIMIT 1",
+                    (now, term),
                 ).fetchone()
 
-            # If any data was returned by the query, it has to be un-pickled before it can be returned to the caller:
+            # If any data was returned by the query, it has to be deserialized before it can be returned to the caller:
             if data is not None:
-                return pickle.loads(data[0])
+                ret = polars.read_ipc(io.BytesIO(data[1]), memory_map=False)
+                API.Cache._mem_cache[term] = (
+                    datetime.datetime.fromisoformat(data[0]),
+                    ret,
+                )
+                return ret
             else:
                 # No data was found in the cache, return None.
                 return None
 
+        @staticmethod
+        def pull_many(
+            terms: list[Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"]],
+        ) -> dict[str, polars.DataFrame]:
+            """Pulls any unexpired DataFrames for each of the specified bill maturities, from memory if this process
+            already has them, otherwise using one query for every remaining term. Returns a dictionary mapping each term
+            to its DataFrame. Terms without any unexpired data are omitted.
+            """
+            now = datetime.datetime.now(tz=API.Cache.timezone)
+
+            # Use the in-memory copies of the data this process already has unexpired ones of.
+            ret: dict[str, polars.DataFrame] = {}
+            for term in terms:
+                mem_cached = API.Cache._mem_cache.get(term)
+                if mem_cached is not None and mem_cached[0] >= now:
+                    ret[term] = mem_cached[1]
+
+            # Only query the cache database for the terms that aren't in memory, if there are any.
+            missing = [term for term in terms if term not in ret]
+            if not missing:
+                return ret
+
+            # Select the unexpired data for every missing term at once. One placeholder is generated per term. Each
+            # term's rows are ordered newest first, matching the row pull would select.
+            placeholders = ", ".join("?" for _ in missing)
+            con = API.Cache._connection()
+            with API.Cache._lock:
+                rows = con.execute(
+                    f"SELECT term, expires, data FROM cache WHERE expires >= ? AND term IN ({placeholders}) "
+                    "ORDER BY term, expires DESC",
+                    (now, *missing),
+                ).fetchall()
+
+            # Deserialize the newest data returned for each term, and keep a copy in memory for subsequent pulls. Any
+            # older rows for a term that was already seen are skipped.
+            for term, expires, data in rows:
+                if term in ret:
+                    continue
+                ret[term] = polars.read_ipc(io.BytesIO(data), memory_map=False)
+                API.Cache._mem_cache[term] = (
+                    datetime.datetime.fromisoformat(expires),
+                    ret[term],
+                )
+            return ret
+
+        @staticmethod
+        def pull_validators(
+            term: Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"],
+        ) -> tuple[int, str | None, str | None] | None:
+            """Pulls the id, ETag, and Last-Modified values of the most recently retrieved row for the specified bill
+            maturity which has either validator, whether or not it has expired. Otherwise, returns None.
+            """
+            con = API.Cache._connection()
+            with API.Cache._lock:
+                return con.execute(
+                    "SELECT id, etag, last_modified FROM cache WHERE term == ? AND (etag IS NOT NULL OR "
+                    "last_modified IS NOT NULL) ORDER BY retrieved DESC LIMIT 1",
+                    (term,),
+                ).fetchone()
+
+        @staticmethod
+        def pull_validators_many(
+            terms: list[Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"]],
+        ) -> tuple[dict[str, int], str | None, str | None] | None:
+            """Pulls the ETag and Last-Modified values shared by the most recently retrieved rows for each of the
+            specified bill maturities, alongside a dictionary mapping each term to the id of its row. Rows only share
+            validators if they were cached together from a single API response for every term. If any term has no
+            row with either validator, or the rows weren't cached together, returns None.
+            """
+            placeholders = ", ".join("?" for _ in terms)
+            con = API.Cache._connection()
+            with API.Cache._lock:
+                rows = con.execute(
+                    f"SELECT term, id, retrieved, etag, last_modified FROM cache WHERE term IN ({placeholders}) AND "
+                    "(etag IS NOT NULL OR last_modified IS NOT NULL) ORDER BY term, retrieved DESC",
+                    terms,
+                ).fetchall()
+
+            # Keep only the most recently retrieved row for each term.
+            newest: dict[str, tuple[int, str, str | None, str | None]] = {}
+            for term, row_id, retrieved, etag, last_modified in rows:
+                if term not in newest:
+                    newest[term] = (row_id, retrieved, etag, last_modified)
+
+            # Every term needs a row, and all of them must have been retrieved at the same time with the same
+            # validators, otherwise the validators don't describe the data for every term.
+            if any(term not in newest for term in terms):
+                return None
+            if len({row[1:] for row in newest.values()}) != 1:
+                return None
+            _, _, etag, last_modified = newest[terms[0]]
+            return {term: row[0] for term, row in newest.items()}, etag, last_modified
+
+        @staticmethod
+        def renew(
+            term: Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"],
+            row_id: int,
+        ) -> polars.DataFrame:
+            """Extends the expiry of the cached row with the specified id to one day from now, and returns its
+            DataFrame. Used when the API reports that the data in that row has not changed since it was retrieved.
+            """
+            # Renewing a single row is just a batch of one.
+            return API.Cache.renew_many({term: row_id})[term]
+
+        @staticmethod
+        def renew_many(
+            row_ids: dict[
+                Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"], int
+            ],
+        ) -> dict[str, polars.DataFrame]:
+            """Extends the expiry of several cached rows to one day from now in a single transaction, and returns their
+            DataFrames. Takes and returns dictionaries keyed by term, mapping to the id of each term's row and to its
+            DataFrame respectively."""
+            # Time of expiry is the time of renewal plus one day, just like a fresh insert.
+            renewed = datetime.datetime.now(tz=API.Cache.timezone)
+            expires = renewed + datetime.timedelta(days=1)
+            con = API.Cache._connection()
+            with API.Cache._lock:
+                # The connection is in autocommit mode, so the transaction has to be opened and committed explicitly.
+                con.execute("BEGIN")
+                try:
+                    con.executemany(
+                        "UPDATE cache SET expires = ? WHERE id == ?",
+                        [(expires, row_id) for row_id in row_ids.values()],
+                    )
+                    data = {
+                        term: con.execute(
+                            "SELECT data FROM cache WHERE id == ?", (row_id,)
+                        ).fetchone()[0]
+                        for term, row_id in row_ids.items()
+                    }
+                except BaseException:
+                    con.execute("ROLLBACK")
+                    raise
+                con.execute("COMMIT")
+
+            # Deserialize the data, and keep a copy in memory for subsequent pulls.
+            ret: dict[str, polars.DataFrame] = {}
+            for term, blob in data.items():
+                ret[term] = polars.read_ipc(io.BytesIO(blob), memory_map=False)
+                API.Cache._mem_cache[term] = (expires, ret[term])
+            return ret
+
     class Requests:
         """ """
 
         url = """https://api.fiscaldata.treasury.gov/services/api/fiscal_service/"""
 
+        # Full URL of the securities auctions endpoint, built once when the class is defined.
+        _endpoint = url + """v1/accounting/od/auctions_query"""
+
+        # A single HTTP session is shared by every request so that TCP/TLS connections to the API are kept alive and
+        # reused, rather than a new connection being negotiated for each bill term. The pool is sized to comfortably
+        # fit one connection per bill term.
+        session = requests.Session()
+        session.headers.update({"Accept-Encoding": "gzip"})
+        session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8))
+
+        # Mapping of API response data column names to the polars types they are ingested as. Every value in the
+        # response is a JSON string, including the numeric columns, so all columns are read as Utf8 first.
+        response_schema: dict[str, polars.PolarsDataType] = {
+            "issue_date": polars.Utf8,
+            "cusip": polars.Utf8,
+            "security_term": polars.Utf8,
+            "price_per100": polars.Utf8,
+            "bid_to_cover_ratio": polars.Utf8,
+        }
+
+        # Columns which contain strings representing floats. These could also contain strings equivalent to "null".
+        float_columns = ("price_per100", "bid_to_cover_ratio")
+
+        @staticmethod
+        def _transform(rows: list[dict[str, str]]) -> polars.DataFrame:
+            """Transforms the rows of data returned by the securities auctions endpoint into a polars DataFrame sorted
+            by each auction's issue date from oldest to newest."""
+            # The API responds with a JSON string containing several rows of dictionaries. To plot the relevant data,
+            # (bill discounted rate over issued date) it needs to be extracted and transformed to a polars DataFrame.
+            # Some rows may contain strings equivalent to "null" where we might otherwise expect a numeric float value.
+            # Those rows are discarded since they're not useful for plotting.
+
+            # The rows are ingested column-wise by polars in one pass. The float columns are cast from strings to floats
+            # non-strictly, so "null" strings (or anything else that can't be interpreted as a float) become real nulls
+            # in the same pass, then any rows containing nulls are dropped. The API always formats issue dates as
+            # YYYY-MM-DD, so they are parsed with that fixed format rather than having polars infer it, and kept as
+            # dates since the time of day is meaningless. The DataFrame is sorted by the bill issue dates, from oldest
+            # to newest.
+            return (
+                polars.from_dicts(rows, schema=API.Requests.response_schema)
+                .with_columns(
+                    polars.col(API.Requests.float_columns).cast(
+                        polars.Float64, strict=False
+                    )
+                )
+                .drop_nulls()
+                .with_columns(
+                    polars.col("issue_date").str.to_date(format="%Y-%m-%d", strict=True)
+                )
+                .sort("issue_date")
+                .set_sorted("issue_date")
+            )
+
+        @staticmethod
+        def _get(
+            _filter: str, headers: dict[str, str] | None = None
+        ) -> tuple[requests.Response, list[dict[str, str]]]:
+            """Makes HTTP GET requests to the securities auctions endpoint for rows matching the specified filter, one
+            per page of results. Returns the response to the first request alongside the rows of data from every page,
+            which is an empty list if the server responds with 304 Not Modified. Raises an error if the server responds
+            with an HTTP error code."""
+            rows: list[dict[str, str]] = []
+            page_number = 1
+            while True:
+                # Only the columns in the response schema are requested, and the page size is raised to the API's
+                # maximum so that almost every query fits in a single page. The optional headers are only sent with the
+                # first request, since they are conditional on the data as a whole.
+                response = API.Requests.session.get(
+                    API.Requests._endpoint,
+                    params={
+                        "filter": _filter,
+                        "sort": "-issue_date",
+                        "fields": ",".join(API.Requests.response_schema.keys()),
+                        "page[size]": 10000,
+                        "page[number]": page_number,
+                    },
+                    headers=headers if page_number == 1 else None,
+                    timeout=30,
+                )
+                response.raise_for_status()
+                if page_number == 1:
+                    first_response = response
+                    if response.status_code == 304:
+                        return first_response, rows
+
+                # The raw response bytes are parsed with orjson, skipping the intermediate decode to str.
+                body = orjson.loads(response.content)
+                rows.extend(body["data"])
+
+                # Keep requesting pages until the last one reported by the API has been received.
+                if page_number >= body["meta"]["total-pages"]:
+                    return first_response, rows
+                page_number += 1
+
         @staticmethod
         def get_security_auctions(
             term: Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"],
@@ -143,13 +510,13 @@ class API:
             DataFrame sorted by each auction's issue date from oldest to newest. If the optional argument use_cache
             is true, then this function will return data from the cache first, if any is available. If there is not any
             cached data, then an API call will be made instead. Responses to successful API calls are cached regardless
-            of whether use_cache is true or not, unless the data is already present in the cache.
+            of whether use_cache is true or not, unless the data is already present in the cache. API calls are made
+            conditional on the data having changed since it was last cached, and if the API reports it hasn't, the
+            previously cached data is renewed and returned instead of being downloaded again.
 
             See:
             ttps://fiscaldata.treasury.gov/datasets/treasury-securities-auctions-data/treasury-securities-auctions-data
             """
-            endpoint = """v1/accounting/od/auctions_query"""
-
             # If use_cache is specified and there is unexpired data matching the specified term, try to skip the API
             # call and returned the cached data instead.
             if use_cache:
@@ -157,88 +524,116 @@ class API:
                 if ret is not None:
                     return ret
 
+            # If the API sent cache validators with previously cached data for this term, send them back so the API can
+            # respond with 304 Not Modified instead of the full data if it hasn't changed.
+            headers = {}
+            validators = API.Cache.pull_validators(term)
+            if validators is not None:
+                _, etag, last_modified = validators
+                if etag is not None:
+                    headers["If-None-Match"] = etag
+                if last_modified is not None:
+                    headers["If-Modified-Since"] = last_modified
+
             # Make an HTTP GET request to the remote API service for fresh data
-            response = requests.get(
-                f"{API.Requests.url}{endpoint}",
-                params={
-                    "filter": f"security_term:eq:{term},security_type:eq:{security_type},issue_date:gte:{issued_since}",
-                    "sort": "-issue_date",
-                },
+            response, rows = API.Requests._get(
+                f"security_term:eq:{term},security_type:eq:{security_type},issue_date:gte:{issued_since}",
+                headers,
             )
-            # Raise an error if the server responds with an HTTP error code
-            response.raise_for_status()
-
-            # Mapping of API response data column names to expected value types
-            response_schema: dict[str : str | float] = {
-                "issue_date": str,
-                "cusip": str,
-                "security_term": str,
-                "price_per100": float,
-                "bid_to_cover_ratio": float,
-            }
 
-            # The API responds with a JSON string containing several rows of dictionaries. To plot the relevant data,
-            # (bill discounted rate over issued date) it needs to be extracted and transformed to a polars DataFrame.
-            # Some rows may contain strings equivalent to "null" where we might otherwise expect a numeric float value.
-            # Those rows are discarded since they're not useful for plotting.
+            # The data hasn't changed since it was cached, so the cached copy is renewed and returned. A 304 response is
+            # only meaningful if validators were sent, since otherwise there is no cached copy it could refer to.
+            if response.status_code == 304:
+                if validators is None:
+                    raise requests.HTTPError(
+                        f"Received 304 Not Modified for term {term} without sending any cache validators.",
+                        response=response,
+                    )
+                return API.Cache.renew(term, validators[0])
+
+            ret = API.Requests._transform(rows)
+
+            # Write the transformed data into the cache database, alongside the response's cache validators.
+            API.Cache.insert(
+                term,
+                ret,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
 
-            # I think this transformation operation could be cleaner.
-
-            # The transformed data is copied into a list of lists containing string and float values in the order
-            # indicated by the response schema specified above.
-            data_transform: list[list[str | float]] = []
-
-            # For each row containing a dictionary in the data provided by the API,
-            for response_row_dict in response.json()["data"]:
-                # The row-wise transformed data will be copied into a list.
-                row_transform: list[str | float] = []
-
-                # Use each column name specified in the schema as a key in the response data row dictionary.
-                for column_name, value_type in response_schema.items():
-                    # This value should be a string:
-                    if value_type == str:
-                        # Make sure the value contained is actually a string.
-                        assert isinstance(response_row_dict[column_name], str)
-                        # Append this value to the transformed row.
-                        row_transform.append(response_row_dict[column_name])
-
-                    # This value should be a string representing a float.
-                    # It could also be a string equivalent to "null".
-                    elif value_type == float:
-                        # Make sure the value is a string.
-                        assert isinstance(response_row_dict[column_name], str)
-                        if response_row_dict[column_name] == "null":
-                            # If this value is a string "null", assign an empty list to row_transform to indicate
-                            # that this row should be discarded from the transform.
-                            row_transform = []
-                            break
-                        else:
-                            try:
-                                # Try to interpret the string as a float.
-                                value = float(response_row_dict[column_name])
-                            except ValueError as exc:
-                                exc.add_note(
-                                    f"The string {response_row_dict[column_name]} in column {column_name}"
-                                    f"cannot be interpreted as a float value."
-                                )
-                                raise exc
-                            # Append this value to the transformed row.
-                            row_transform.append(value)
-
-                # Append this non-zero length transformed row to the list of transformed rows.
-                if not len(row_transform) == 0:
-                    data_transform.append(row_transform)
-
-            # Package the transformed data into a polars DataFrame. The DataFrame column types are specified to match
-            # the schema described above. The DataFrame is sorted by the bill issue dates, from oldest to newest.
-            ret = (
-                polars.DataFrame(data_transform, response_schema)
-                .with_columns(polars.col("issue_date").str.to_datetime())
-                .set_sorted("issue_date")
+            # Return the transformed data to the caller.
+            return ret
+
+        @staticmethod
+        def get_all_bill_auctions(
+            terms: list[Literal["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"]],
+            issued_since: str,
+            use_cache=True,
+        ) -> dict[str, polars.DataFrame]:
+            """
+            Requests historical data on Treasury Bill auctions of every term from the US Treasury Fiscal Data API with
+            a single API call, rather than one call per term. Then, partitions the transformed DataFrame by term and
+            returns a dictionary mapping each of the specified terms to its DataFrame, sorted by each auction's issue
+            date from oldest to newest. Terms that the API returned no data for are omitted. If the optional argument
+            use_cache is true, and there is cached data for every specified term, then the cached data is returned
+            instead of making an API call. The specified terms' data is cached in a single transaction after a
+            successful API call, regardless of whether use_cache is true or not. Data for any other terms returned by
+            the API (such as 17-Week bills or cash management bills) is discarded rather than cached. API calls are made
+            conditional on the data having changed since it was last cached, and if the API reports it hasn't, the
+            previously cached data for every specified term is renewed and returned instead of being downloaded again.
+            """
+            # If use_cache is specified and there is unexpired data for every term, skip the API call entirely.
+            if use_cache:
+                ret = API.Cache.pull_many(terms)
+                if all(term in ret for term in terms):
+                    return {term: ret[term] for term in terms}
+
+            # If the API sent cache validators with the data previously cached for every term at once, send them back
+            # so the API can respond with 304 Not Modified instead of the full data if it hasn't changed.
+            headers = {}
+            validators = API.Cache.pull_validators_many(terms)
+            if validators is not None:
+                _, etag, last_modified = validators
+                if etag is not None:
+                    headers["If-None-Match"] = etag
+                if last_modified is not None:
+                    headers["If-Modified-Since"] = last_modified
+
+            # Make one HTTP GET request to the remote API service for fresh data on all bills.
+            response, rows = API.Requests._get(
+                f"security_type:eq:Bill,issue_date:gte:{issued_since}", headers
+            )
+
+            # The data hasn't changed since it was cached, so every term's cached copy is renewed and returned.
+            if response.status_code == 304:
+                if validators is None:
+                    raise requests.HTTPError(
+                        "Received 304 Not Modified for all bills without sending any cache validators.",
+                        response=response,
+                    )
+                ret = API.Cache.renew_many(validators[0])
+                return {term: ret[term] for term in terms}
+
+            # Transform the data for every bill, then partition it by term.
+            partitions = API.Requests._transform(rows).partition_by(
+                "security_term", as_dict=True
             )
 
-            # Write the transformed data into the cache database.
-            API.Cache.insert(term, ret)
+            # Partitioning keeps the issue date order of the rows, so each partition is still sorted.
+            partitions = {
+                term: df.set_sorted("issue_date") for term, df in partitions.items()
+            }
+
+            # Keep the data for only the specified terms.
+            ret = {term: partitions[term] for term in terms if term in partitions}
+
+            # Write every specified term's data into the cache database at once, alongside the response's cache
+            # validators. Every row gets the same validators, since they describe the response for all bills.
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            API.Cache.insert_many(
+                [(term, df, etag, last_modified) for term, df in ret.items()]
+            )
 
             # Return the transformed data to the caller.
             return ret
@@ -248,23 +643,14 @@ if __name__ == "__main__":
     # Initialize the API response cache database. No-op if already initialized.
     API.Cache.initialize()
 
-    # Retrieve data.
+    # Retrieve data. Every term is retrieved with a single API call, unless all of them are already cached.
     _use_cache = True
-    four_week = API.Requests.get_security_auctions(
-        "4-Week", "Bill", "2022-01-01", _use_cache
-    )
-    eight_week = API.Requests.get_security_auctions(
-        "8-Week", "Bill", "2022-01-01", _use_cache
-    )
-    thirteen_week = API.Requests.get_security_auctions(
-        "13-Week", "Bill", "2022-01-01", _use_cache
-    )
-    twentysix_week = API.Requests.get_security_auctions(
-        "26-Week", "Bill", "2022-01-01", _use_cache
-    )
-    fiftytwo_week = API.Requests.get_security_auctions(
-        "52-Week", "Bill", "2022-01-01", _use_cache
-    )
+    terms = ["4-Week", "8-Week", "13-Week", "26-Week", "52-Week"]
+    bills = API.Requests.get_all_bill_auctions(terms, "2022-01-01", _use_cache)
+
+    # matplotlib is only needed for plotting, so it is imported here rather than at the top of this module. This spares
+    # its considerable import time whenever the API class is used on its own.
+    import matplotlib.pyplot as plt
 
     # Create a figure containing one subplot
     fig, ax = plt.subplots()
@@ -276,14 +662,10 @@ if __name__ == "__main__":
     ax.set_xlabel("Issue Date")
     ax.set_ylabel("Price per $100")
 
-    # Create five step-plots for each security type, all using the same figure
-    ax.step(four_week["issue_date"], four_week["price_per100"], label="4-Week")
-    ax.step(eight_week["issue_date"], eight_week["price_per100"], label="8-Week")
-    ax.step(thirteen_week["issue_date"], thirteen_week["price_per100"], label="13-Week")
-    ax.step(
-        twentysix_week["issue_date"], twentysix_week["price_per100"], label="26-Week"
-    )
-    ax.step(fiftytwo_week["issue_date"], fiftytwo_week["price_per100"], label="52-Week")
+    # Create five step-plots for each security type, all using the same figure. Each column is converted to a NumPy
+    # array up front so matplotlib doesn't have to convert the polars Series itself.
+    for term, df in bills.items():
+        ax.step(df["issue_date"].to_numpy(), df["price_per100"].to_numpy(), label=term)
 
     # Enable solid gridlines on both axes
     ax.grid(axis="both", alpha=1)